@@ -6,4 +6,5 @@ from app.core.config import settings
 
 
 index_path = settings.FAISS_INDEX_PATH
-metadata_path = settings.RAG_JSON_DATA
\ No newline at end of file
+metadata_path = settings.RAG_JSON_DATA
+lang_model_path = settings.LANG_DETECT_MODEL_PATH
\ No newline at end of file
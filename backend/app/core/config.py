@@ -1,10 +1,12 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Optional
 
 
 class Settings(BaseSettings):
     # MongoDB
     MONGO_URI: str = "mongodb://localhost:27017"
     MONGO_DB_NAME: str = "khoaluan_db"
+    MONGO_MAX_POOL_SIZE: int = 200
 
     # JWT
     SECRET_KEY: str
@@ -31,10 +33,24 @@ class Settings(BaseSettings):
     # HuggingFace
     HUGGING_FACE_API_KEY: str
     HUGGING_FACE_MODEL_ID: str = "deepseek-ai/DeepSeek-V3-0324"
+    HF_MAX_INFLIGHT: int = 16
+    HF_TIMEOUT: float = 60  # seconds
+    HF_USE_CACHE: bool = True
+    HF_SEED: Optional[int] = 42  # fixed seed so repeated prompts hit the server cache
+    MAX_INFLIGHT_PER_USER: int = 3
+    ANSWER_CACHE_MAXSIZE: int = 10_000
+    ANSWER_CACHE_TTL: int = 3600  # seconds
 
     RAG_JSON_DATA: str = "./all_vector_data.json"
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
     FAISS_INDEX_PATH: str = "./all_vector_index.faiss"
+    LANG_DETECT_MODEL_PATH: str = "./lid.176.ftz"  # fastText language-ID model
+
+    # Semantic answer cache
+    SEMANTIC_CACHE_THRESHOLD: float = 0.93  # min cosine similarity
+    SEMANTIC_CACHE_MIN_EVIDENCE_OVERLAP: float = 0.8  # min Jaccard of retrieved docs
+    SEMANTIC_CACHE_TTL: int = 3600  # seconds
+    SEMANTIC_CACHE_MAXSIZE: int = 10_000
 
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding='utf-8')
@@ -0,0 +1,10 @@
+from prometheus_client import Histogram
+
+# Latency of each model call behind a bot answer, as seen by the endpoint
+# (includes cache hits and time queued in the inference worker)
+HF_CALL_SECONDS = Histogram(
+    "chatbot_hf_call_seconds",
+    "Latency of Hugging Face model calls per answer section",
+    ["call"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90),
+)
@@ -7,6 +7,7 @@ from app.models.message import Message
 from app.core.config import settings
 
 async def init_db():
-    client = motor.motor_asyncio.AsyncIOMotorClient(settings.MONGO_URI)
+    client = motor.motor_asyncio.AsyncIOMotorClient(
+        settings.MONGO_URI, maxPoolSize=settings.MONGO_MAX_POOL_SIZE)
     
     await init_beanie(database=client[settings.MONGO_DB_NAME], document_models=[User, PasswordResetToken, Profile, Conversation, Message])
\ No newline at end of file
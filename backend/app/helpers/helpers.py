@@ -10,6 +10,7 @@ import json
 import re
 import uuid
 import os
+from contextlib import nullcontext
 
 # Function to extract text from a PDF file
 # This function reads the PDF file and extracts text from specified pages
@@ -152,7 +153,9 @@ def process_document_to_faiss(
     topic="general",
     source=None,
     index=None,                
-    vector_data=None           
+    vector_data=None,
+    lock=None,                 # guards index/vector_data against concurrent readers
+    on_update=None             # called under `lock` once both are updated
 ):
     if source is None:
         source = os.path.basename(file_upload.filename)
@@ -187,20 +190,23 @@ def process_document_to_faiss(
     new_vector_data = build_vector_dataset(chunk_texts, contexts, embeddings, source, topic=topic)
 
     print("Updating FAISS index...")
-    if index is None:
-        # Create a new index
-        index = build_faiss_index(embeddings)
-    else:
-        # Check embedding dimension matches
-        if embeddings.shape[1] != index.d:
-            raise ValueError(f"Dimension mismatch! Index dim={index.d}, new vectors dim={embeddings.shape[1]}")
-        index.add(embeddings)  # Append to existing index
-
-    # Append new vector entries to dataset
-    vector_data.extend(new_vector_data)
-
-    save_faiss_index(index, index_path)
-    save_metadata(vector_data, metadata_path)
+    with lock or nullcontext():
+        if index is None:
+            # Create a new index
+            index = build_faiss_index(embeddings)
+        else:
+            # Check embedding dimension matches
+            if embeddings.shape[1] != index.d:
+                raise ValueError(f"Dimension mismatch! Index dim={index.d}, new vectors dim={embeddings.shape[1]}")
+            index.add(embeddings)  # Append to existing index
+
+        # Append new vector entries to dataset
+        vector_data.extend(new_vector_data)
+        if on_update is not None:
+            on_update()
+
+        save_faiss_index(index, index_path)
+        save_metadata(vector_data, metadata_path)
 
     print(f"Added {len(new_vector_data)} new chunks from '{source}'")
     print(f"Total vectors in index: {index.ntotal}")
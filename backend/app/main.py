@@ -1,8 +1,9 @@
 from fastapi import FastAPI, Request, status
 from fastapi.exceptions import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 import uvicorn
+from prometheus_client import make_asgi_app
 
 from app.rag import rag_module
 from app.helpers import helpers
@@ -10,7 +11,7 @@ from app.db.mongo import init_db
 from app.routes import auth, mail, user, conversation, message, rag
 from app.core.response import Response
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,6 +30,10 @@ async def start_db():
     except Exception as e:
         print(f"Could not connect to the database: {e}")
 
+@app.on_event("shutdown")
+async def stop_inference_worker():
+    await message.inference_worker.close()
+
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     return JSONResponse(
@@ -57,6 +62,8 @@ app.include_router(conversation.route)
 app.include_router(message.route)
 app.include_router(rag.route)
 
+app.mount("/metrics", make_asgi_app())
+
 @app.get("/", tags=["Root"], response_model=Response[dict])
 async def root():
     return Response(data={"message": "Welcome to your beanie powered app!"})
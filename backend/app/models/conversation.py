@@ -3,6 +3,7 @@ from pydantic import Field, BaseModel, field_validator
 from app.models.user import User
 from datetime import datetime
 from typing import List
+import pymongo
 
 class Conversation(Document):
     user: Link[User]
@@ -12,10 +13,14 @@ class Conversation(Document):
 
     class Settings:
         name = "conversations"
-        indexers = [
+        indexes = [
             "user",
             "created_at",
             "last_updated",
+            # Ownership checks: find_one(id == X, user.id == Y)
+            [("user.$id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            # Conversation list of a user, newest first
+            [("user.$id", pymongo.ASCENDING), ("last_updated", pymongo.DESCENDING)],
         ]
     
     async def update_last_updated(self):
@@ -1,8 +1,9 @@
 from beanie import Document, Link, PydanticObjectId
-from pydantic import Field, BaseModel, field_validator
+from pydantic import Field, BaseModel, ConfigDict, field_validator
 from app.models.user import User
 from app.models.conversation import Conversation
 from datetime import datetime
+import pymongo
 
 class Message(Document):
     conversation: Link[Conversation]
@@ -14,10 +15,16 @@ class Message(Document):
         name = "messages"
         indexes=[
             "conversation",
-            "created_at"
+            "created_at",
+            # Covers the message-id listing of a conversation
+            [("conversation.$id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            # Messages of a conversation in chronological order
+            [("conversation.$id", pymongo.ASCENDING), ("created_at", pymongo.ASCENDING)],
         ]
 
 class MessageOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: PydanticObjectId
     conversation: PydanticObjectId
     sender_type: str
@@ -33,6 +40,9 @@ class MessageOut(BaseModel):
             return v.id
         return v
 
+class MessageIdOut(BaseModel):
+    id: PydanticObjectId = Field(..., alias="_id")
+
 class MessageCreate(BaseModel):
     conversation_id: PydanticObjectId
     content: str
\ No newline at end of file
@@ -1,6 +1,26 @@
+import os
+from functools import lru_cache
+
+import fasttext
 from langdetect import detect
 
+from app.constant import lang_model_path
+
+# fastText language identification (lid.176): C++ backed, microseconds per call.
+# Falls back to langdetect when the model file has not been deployed.
+if os.path.exists(lang_model_path):
+    _model = fasttext.load_model(lang_model_path)
+else:
+    _model = None
+    print(f"Warning: language model not found at {lang_model_path}, using langdetect")
+
+@lru_cache(maxsize=4096)
 def detect_language(text: str) -> str:
-    lang = detect(text)
+    if _model is not None:
+        # fastText predicts one line at a time
+        labels, _ = _model.predict(text.replace("\n", " "), k=1)
+        lang = labels[0].removeprefix("__label__")
+    else:
+        lang = detect(text)
     print(f"Detected language: {lang}")
-    return lang
\ No newline at end of file
+    return lang
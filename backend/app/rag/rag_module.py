@@ -1,4 +1,7 @@
 import numpy as np
+import hashlib
+import threading
+from cachetools import LRUCache
 from nltk.data import retrieve
 from sentence_transformers import SentenceTransformer
 
@@ -17,27 +20,56 @@ class RAGSingleton:
             cls._instance.index = index
             cls._instance.metadata = metadata
             cls._instance.embedder = SentenceTransformer("all-MiniLM-L6-v2")
+            # Bumped whenever the index/metadata change so caches can invalidate
+            cls._instance.index_version = 0
+            cls._instance._prompt_cache = LRUCache(maxsize=4096)
+            cls._instance._prompt_cache_lock = threading.Lock()
+            # FAISS does not allow adding to an index while another thread
+            # searches it; hold this around searches and index/metadata updates
+            cls._instance.index_lock = threading.Lock()
 
         return cls._instance
 
-    def retrieve(self, query, k=3):
-        query_vec = self.embedder.encode([query], normalize_embeddings=True)
-        D, I = self.index.search(np.array(query_vec).astype('float32'), k)
+    def retrieve(self, query, k=3, ids=None):
+        # `ids` are search results already computed for this query
+        if ids is None:
+            query_vec = self.embedder.encode([query], normalize_embeddings=True)
+            with self.index_lock:
+                D, I = self.index.search(np.array(query_vec).astype('float32'), k)
+            ids = I[0]
         
         # Defensive: filter out invalid indices (-1)
         retrieved_contexts = []
-        for i in I[0]:
-            if i != -1 and i < len(self.metadata):
-                retrieved_contexts.append(self.metadata[i]["content"])
-            else:
-                print(f"Warning: index {i} out of bounds or invalid")
+        with self.index_lock:
+            for i in ids:
+                if i != -1 and i < len(self.metadata):
+                    retrieved_contexts.append(self.metadata[i]["content"])
+                else:
+                    print(f"Warning: index {i} out of bounds or invalid")
         
         full_context = " ".join(retrieved_contexts)
         return full_context
 
-    def generate_prompt(self, query):
-        context = self.retrieve(query)
-        return generate_prompt(query, context) 
+    def bump_index_version(self):
+        """Invalidate caches built on the index; call under `index_lock`."""
+        self.index_version += 1
+
+    def generate_prompt(self, query, ids=None, version=None):
+        # Precomputed `ids` are only reused if they came from the current index
+        if version != self.index_version:
+            ids = None
+        key = (self.index_version,
+               hashlib.blake2b(query.encode("utf-8"), digest_size=16).digest())
+        with self._prompt_cache_lock:
+            prompt = self._prompt_cache.get(key)
+        if prompt is not None:
+            return prompt
+
+        context = self.retrieve(query, ids=ids)
+        prompt = generate_prompt(query, context)
+        with self._prompt_cache_lock:
+            self._prompt_cache[key] = prompt
+        return prompt
 
 metadata = helpers.load_metadata(metadata_path)
 index = helpers.load_faiss_index(index_path)
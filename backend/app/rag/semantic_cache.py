@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+from app.rag.rag_module import rag
+
+
+class CacheProbe(NamedTuple):
+    query: str
+    query_vec: np.ndarray
+    ids: tuple  # RAG search results for the query, in rank order
+    version: int  # rag.index_version the search ran against
+
+    @property
+    def evidence(self) -> frozenset:
+        return frozenset(i for i in self.ids if i != -1)
+
+
+class SemanticCache:
+    """
+    Cache of full bot answers keyed by the embedding of the user question.
+
+    A lookup is a hit only when the closest cached question is similar enough
+    AND the RAG retrieval for both questions returns (mostly) the same
+    documents, so paraphrases are served without answering from stale or
+    unrelated evidence.
+    """
+
+    def __init__(self, rag, threshold, min_evidence_overlap, ttl, maxsize, k=3):
+        self.rag = rag
+        self.threshold = threshold
+        self.min_evidence_overlap = min_evidence_overlap
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.k = k
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        dim = self.rag.embedder.get_sentence_embedding_dimension()
+        self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self._entries = OrderedDict()  # id -> (prompt, answer, evidence, ts)
+        self._next_id = 0
+        self._version = self.rag.index_version
+
+    def _evict(self, ids):
+        for entry_id in ids:
+            self._entries.pop(entry_id, None)
+        self._index.remove_ids(np.array(ids, dtype="int64"))
+
+    def lookup(self, query):
+        """
+        Return (answer or None, probe). On a miss, pass the probe's ids and
+        version to `rag.generate_prompt` and the probe to `store`, so the
+        query is embedded and searched only once.
+        """
+        query_vec = np.array(self.rag.embedder.encode(
+            [query], normalize_embeddings=True)).astype("float32")
+        # Read the version with the search so the probe matches the index state
+        with self.rag.index_lock:
+            version = self.rag.index_version
+            _, I = self.rag.index.search(query_vec, self.k)
+        probe = CacheProbe(query, query_vec, tuple(int(i) for i in I[0]), version)
+        evidence = probe.evidence
+
+        with self._lock:
+            if self._version != self.rag.index_version:
+                self._reset()
+            if self._index.ntotal == 0:
+                return None, probe
+
+            D, I = self._index.search(query_vec, 1)
+            score, entry_id = float(D[0][0]), int(I[0][0])
+            entry = self._entries.get(entry_id)
+            if entry is None or score < self.threshold:
+                return None, probe
+
+            _, answer, cached_evidence, ts = entry
+            if time.monotonic() - ts > self.ttl:
+                self._evict([entry_id])
+                return None, probe
+
+            union = evidence | cached_evidence
+            overlap = len(evidence & cached_evidence) / len(union) if union else 1.0
+            if overlap < self.min_evidence_overlap:
+                return None, probe
+
+            self._entries.move_to_end(entry_id)
+            return answer, probe
+
+    def store(self, probe, answer):
+        with self._lock:
+            # The answer was built from an index that has since been replaced
+            if probe.version != self.rag.index_version:
+                return
+            if self._version != probe.version:
+                self._reset()
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(probe.query_vec, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = (probe.query, answer, probe.evidence, time.monotonic())
+
+            overflow = len(self._entries) - self.maxsize
+            if overflow > 0:
+                self._evict(list(self._entries)[:overflow])
+
+
+semantic_cache = SemanticCache(
+    rag,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    min_evidence_overlap=settings.SEMANTIC_CACHE_MIN_EVIDENCE_OVERLAP,
+    ttl=settings.SEMANTIC_CACHE_TTL,
+    maxsize=settings.SEMANTIC_CACHE_MAXSIZE,
+)
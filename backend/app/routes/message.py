@@ -1,17 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, status, BackgroundTasks
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from beanie import PydanticObjectId
 from typing import List
 from huggingface_hub import InferenceClient
+from cachetools import TTLCache
 
-from app.models.message import Message, MessageCreate, MessageOut
+from app.models.message import Message, MessageCreate, MessageOut, MessageIdOut
 from app.models.conversation import Conversation
 from app.models.user import User
 from app.routes.user import get_current_user
 from app.core.response import Response
 from app.core.config import settings
+from app.core.metrics import HF_CALL_SECONDS
 from app.rag.rag_module import rag as rag_instance
-from app.rag.lang_detector import detect_language
+from app.rag.semantic_cache import semantic_cache
+from app.services.inference_worker import InferenceWorker
 import asyncio
+import hashlib
+import json
+import logging
+import time
+import weakref
 
 route = APIRouter(
     prefix="/messages",
@@ -21,20 +30,195 @@ route = APIRouter(
 HUGGING_FACE_API_KEY = settings.HUGGING_FACE_API_KEY
 HUGGING_FACE_MODEL_ID = settings.HUGGING_FACE_MODEL_ID
 
-print("HUGGING_FACE_API_KEY: ", HUGGING_FACE_API_KEY, " - ",
-      "HUGGING_FACE_MODEL_ID: ", HUGGING_FACE_MODEL_ID)
+logger = logging.getLogger(__name__)
+# Never log the API key
+logger.debug("HUGGING_FACE_MODEL_ID: %s", HUGGING_FACE_MODEL_ID)
 
+# One client for every model call. huggingface_hub keeps one pooled
+# requests.Session per thread, so calls reuse keep-alive connections.
 client = InferenceClient(
     model=HUGGING_FACE_MODEL_ID,
-    token=HUGGING_FACE_API_KEY
+    token=HUGGING_FACE_API_KEY,
+    timeout=settings.HF_TIMEOUT,
+    # Let the inference server reuse cached generations for identical inputs
+    headers={"x-use-cache": "true" if settings.HF_USE_CACHE else "false"}
 )
 
-raw_client = InferenceClient(
-    model=HUGGING_FACE_MODEL_ID,
-    token=HUGGING_FACE_API_KEY
+# Exact-match answer cache: (model, index version, prompt digest) -> answer text
+_ANS_CACHE = TTLCache(maxsize=settings.ANSWER_CACHE_MAXSIZE,
+                      ttl=settings.ANSWER_CACHE_TTL)
+_ANS_LOCKS: dict = {}
+
+
+_USER_ROLE = "user"
+# Shown in place of a section whose model did not answer in time
+_UNAVAILABLE = "(model unavailable)"
+
+
+# The client is bound to HUGGING_FACE_MODEL_ID, so no per-call model argument
+def _complete(prompt: str) -> str:
+    completion = client.chat.completions.create(
+        messages=[{"role": _USER_ROLE, "content": prompt}],
+        seed=settings.HF_SEED,
+    )
+    return completion.choices[0].message.content
+
+
+def _stream_complete(prompt: str):
+    stream = client.chat.completions.create(
+        messages=[{"role": _USER_ROLE, "content": prompt}],
+        seed=settings.HF_SEED,
+        stream=True,
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+# The fine-tuned model without RAG is the same call as the raw model, so it has
+# no section of its own; (1) is the canonical fine-tuned answer
+def _combine_answers(rag_ans: str, plain_ans: str) -> str:
+    return "\n\n".join([
+        "**1) Fine-tuned + RAG:** " + rag_ans,
+        "**2) Raw-model**: " + plain_ans,
+    ])
+
+
+# Its thread pool caps the number of inference calls in flight
+inference_worker = InferenceWorker(
+    _complete,
+    max_workers=settings.HF_MAX_INFLIGHT,
+    stream_complete=_stream_complete,
 )
 
 
+async def _ask(prompt: str) -> str:
+    """Answer `prompt` from the cache or through the shared inference worker."""
+    return await _cached_answer(client.model, prompt,
+                                lambda: inference_worker.submit(prompt))
+
+
+async def _timed(call: str, answer) -> str:
+    start = time.perf_counter()
+    try:
+        return await answer
+    finally:
+        HF_CALL_SECONDS.labels(call=call).observe(time.perf_counter() - start)
+
+
+def _section_answer(task: asyncio.Task, section: str):
+    """Result of a finished model call, or None if it timed out or failed."""
+    if not task.done() or task.cancelled():
+        logger.warning("Model call for %s timed out", section)
+        return None
+    if task.exception() is not None:
+        logger.warning("Model call for %s failed: %s", section, task.exception())
+        return None
+    return task.result()
+
+
+def _answer_cache_key(model: str, prompt: str) -> tuple:
+    normalized = " ".join(prompt.split())
+    digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+    return (model, rag_instance.index_version, digest)
+
+
+async def _cached_answer(model: str, prompt: str, run) -> str:
+    """
+    Return the cached answer for (model, prompt) or compute it with `run`.
+    Concurrent callers with the same key wait for the first one instead of
+    firing duplicate inference calls.
+    """
+    key = _answer_cache_key(model, prompt)
+    answer = _ANS_CACHE.get(key)
+    if answer is not None:
+        return answer
+
+    # [lock, callers holding or waiting on it]; the entry lives until the last
+    # caller leaves, so a failed first call never lets a newcomer bypass the
+    # waiters with a fresh lock
+    entry = _ANS_LOCKS.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            answer = _ANS_CACHE.get(key)
+            if answer is None:
+                answer = await run()
+                _ANS_CACHE[key] = answer
+            return answer
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _ANS_LOCKS.pop(key, None)
+
+
+# Requests currently being answered: (user, conversation, content digest) -> Future
+_INFLIGHT: dict = {}
+# Number of requests currently being answered per user
+_USER_INFLIGHT: dict = {}
+
+
+def _consume_exception(future: asyncio.Future):
+    if not future.cancelled():
+        future.exception()
+
+
+def _acquire_user_slot(user_id):
+    """Count one more request in progress for the user, or reject with 429."""
+    if _USER_INFLIGHT.get(user_id, 0) >= settings.MAX_INFLIGHT_PER_USER:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many messages in progress, please wait for the previous answers"
+        )
+    _USER_INFLIGHT[user_id] = _USER_INFLIGHT.get(user_id, 0) + 1
+
+
+def _release_user_slot(user_id):
+    _USER_INFLIGHT[user_id] -= 1
+    if not _USER_INFLIGHT[user_id]:
+        del _USER_INFLIGHT[user_id]
+
+
+async def _run_once(key: tuple, user_id, work):
+    """
+    Run `work()` unless an identical request is already in flight, in which
+    case wait for its result. Also caps concurrent requests per user.
+    """
+    inflight = _INFLIGHT.get(key)
+    if inflight is not None:
+        return await asyncio.shield(inflight)
+
+    _acquire_user_slot(user_id)
+    future = asyncio.get_running_loop().create_future()
+    future.add_done_callback(_consume_exception)
+    _INFLIGHT[key] = future
+    try:
+        result = await work()
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    except BaseException:
+        future.cancel()
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        del _INFLIGHT[key]
+        _release_user_slot(user_id)
+
+
+async def _owns_conversation(conversation_id: PydanticObjectId, user_id: PydanticObjectId) -> bool:
+    """
+    Check conversation ownership with an index-only count instead of
+    dereferencing message.conversation.user.
+    """
+    return await Conversation.find(
+        Conversation.id == conversation_id,
+        Conversation.user.id == user_id
+    ).count() > 0
+
+
 @route.get("/conversation/{conversation_id}/ids", response_model=Response[List[PydanticObjectId]])
 async def get_message_ids_in_conversation(conversation_id: PydanticObjectId, current_user: User = Depends(get_current_user)):
     """
@@ -45,23 +229,55 @@ async def get_message_ids_in_conversation(conversation_id: PydanticObjectId, cur
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Conversation not found or you don't have permission")
 
-    messages = await Message.find(Message.conversation.id == conversation_id).project(Message).to_list()
+    messages = await Message.find(Message.conversation.id == conversation_id).project(MessageIdOut).to_list()
     message_ids = [msg.id for msg in messages]
     return Response(data=message_ids)
 
 
 @route.get("/conversation/{conversation_id}", response_model=Response[List[MessageOut]])
-async def get_messages_in_conversation(conversation_id: PydanticObjectId, skip: int = 0, limit: int = 100, current_user: User = Depends(get_current_user)):
+async def get_messages_in_conversation(conversation_id: PydanticObjectId, skip: int = Query(0, ge=0), limit: int = Query(100, ge=0), current_user: User = Depends(get_current_user)):
     """
     Get a list of messages of a specific conversation with pagination.
+    Ownership check and message page are fetched in one aggregation.
     """
-    conversation = await Conversation.find_one(Conversation.id == conversation_id, Conversation.user.id == current_user.id)
-    if not conversation:
+    page = [
+        {"$match": {"conversation.$id": conversation_id}},
+        {"$sort": {"created_at": 1}},
+        {"$skip": skip},
+    ]
+    if limit:
+        page.append({"$limit": limit})
+    page.append({"$project": {
+        "_id": 0,
+        "id": {"$toString": "$_id"},
+        "conversation": {"$literal": str(conversation_id)},
+        "sender_type": 1,
+        "content": 1,
+        "created_at": 1,
+    }})
+
+    result = await Conversation.aggregate([
+        {"$match": {"_id": conversation_id, "user.$id": current_user.id}},
+        {"$lookup": {
+            "from": Message.get_collection_name(),
+            "pipeline": page,
+            "as": "messages",
+        }},
+        # Directly after $lookup, MongoDB coalesces the $unwind into it and
+        # streams one row per message, so a long page never has to fit in a
+        # single 16 MB document. An owned but empty conversation still yields
+        # one empty row, which tells it apart from the 404 case.
+        {"$unwind": {"path": "$messages", "preserveNullAndEmptyArrays": True}},
+        {"$replaceRoot": {"newRoot": {"$ifNull": ["$messages", {}]}}},
+    ]).to_list()
+    if not result:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Conversation not found or you don't have permission")
+    messages = [row for row in result if row]
 
-    messages = await Message.find(Message.conversation.id == conversation_id).sort(+Message.created_at).skip(skip).limit(limit).to_list()
-    return Response(data=messages)
+    # Rows already have MessageOut's JSON shape, so skip response_model
+    # re-validation and let orjson encode them directly
+    return ORJSONResponse(Response(data=messages).model_dump())
 
 
 @route.get("/{message_id}", response_model=Response[MessageOut])
@@ -69,12 +285,12 @@ async def get_message(message_id: PydanticObjectId, current_user: User = Depends
     """
     Get details of a specific message.
     """
-    message = await Message.get(message_id, fetch_links=True)
+    message = await Message.get(message_id)
     if not message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
 
-    if message.conversation.user.id != current_user.id:
+    if not await _owns_conversation(message.conversation.ref.id, current_user.id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="You don't have permission to access this message")
 
@@ -84,11 +300,15 @@ async def get_message(message_id: PydanticObjectId, current_user: User = Depends
 @route.post("/", status_code=status.HTTP_201_CREATED, response_model=Response[MessageOut])
 async def create_message_with_rag(
     message_data: MessageCreate,
+    background: BackgroundTasks,
     current_user: User = Depends(get_current_user),
 ):
     """
     Create one user message and return ONE bot message that concatenates
-    answers from 3 models: (1) Fine-tuned + RAG, (2) raw-model, (3) Fine-tuned.
+    answers from (1) Fine-tuned + RAG and (2) raw-model. The former separate
+    Fine-tuned section sent the same prompt to the same model as (2), so it is
+    dropped and (1) is the canonical fine-tuned answer. A model that does not
+    answer within HF_TIMEOUT is shown as "(model unavailable)".
     """
     # 1) Check conversation ownership
     conversation = await Conversation.find_one(
@@ -101,85 +321,215 @@ async def create_message_with_rag(
             detail="Conversation not found or you don't have permission"
         )
 
-    # 2) Non-blocking pause (if you really need it)
-    await asyncio.sleep(2)
+    async def build_bot_message() -> Message:
+        # 2) Look for an answer to a paraphrase of this question
+        cached_content, cache_probe = await asyncio.to_thread(
+            semantic_cache.lookup, message_data.content)
 
-    # 3) Insert user message once
-    new_user_message = Message(
-        **message_data.model_dump(exclude={"conversation_id"}),
-        conversation=conversation.id,
-        sender_type="User"
-    )
-    await new_user_message.insert()
-
-    # 4) Prepare shared inputs
-    lang = detect_language(message_data.content)
-    rag_context = rag_instance.generate_prompt(
-        message_data.content)  # keep one name
-
-    # Helpers: wrap blocking SDK calls so we don't block the event loop
-    async def call_finetuned_with_rag() -> str:
-        def _run():
-            completion = client.chat.completions.create(
-                model=client.model,
-                messages=[{"role": "user", "content": rag_context}],
+        # 3) Insert user message once, concurrently with retrieval and the models
+        new_user_message = Message(
+            **message_data.model_dump(exclude={"conversation_id"}),
+            conversation=conversation.id,
+            sender_type="User"
+        )
+        user_insert = asyncio.create_task(new_user_message.insert())
+
+        # 4) Reuse the cached answer, or run the model calls concurrently
+        if cached_content is not None:
+            await user_insert
+            rsp_content = cached_content
+        else:
+            # Reuse the cache lookup's search results instead of embedding the
+            # query again. The prompt builder detects the language itself, so
+            # no separate call is needed.
+            rag_context = await asyncio.to_thread(
+                rag_instance.generate_prompt, message_data.content,
+                cache_probe.ids, cache_probe.version)
+
+            rag_call = asyncio.create_task(_timed("ft_rag", _ask(rag_context)))
+            plain_call = asyncio.create_task(_timed("raw", _ask(message_data.content)))
+            calls = {rag_call, plain_call}
+            try:
+                await user_insert
+                # A stalled model must not pin the request: answer with
+                # whatever finished in time
+                await asyncio.wait(calls, timeout=settings.HF_TIMEOUT)
+            finally:
+                for call in calls:
+                    call.cancel()
+
+            rag_ans = _section_answer(rag_call, "ft_rag")
+            plain_ans = _section_answer(plain_call, "raw")
+            if rag_ans is None and plain_ans is None:
+                error = (rag_call.exception() if rag_call.done() and not rag_call.cancelled()
+                         else "no model answered in time")
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Failed to get response from chatbot: {error}"
+                )
+
+            # 5) Combine to one bot message content. Degraded answers are not
+            # cached so the next ask retries the missing model
+            rsp_content = _combine_answers(
+                _UNAVAILABLE if rag_ans is None else rag_ans,
+                _UNAVAILABLE if plain_ans is None else plain_ans,
             )
-            return "**1) Fine-tuned + RAG:** " + completion.choices[0].message.content
-        return await asyncio.to_thread(_run)
+            if rag_ans is not None and plain_ans is not None:
+                semantic_cache.store(cache_probe, rsp_content)
+
+        # 6) Save the bot message before responding: the client refetches the
+        # message list as soon as the POST resolves. Only the timestamp
+        # update waits until after the response.
+        new_bot_message = Message(
+            conversation=conversation.id,
+            sender_type="Bot",
+            content=rsp_content
+        )
+        await new_bot_message.insert()
+        background.add_task(conversation.update_last_updated)
+        return new_bot_message
 
-    async def call_raw_model() -> str:
-        def _run():
-            prompt = (
-                message_data.content
-            )
-            completion = raw_client.chat.completions.create(
-                model=raw_client.model,
-                messages=[{"role": "user", "content": prompt}],
-            )
-            return "**2) Raw-model**: " + completion.choices[0].message.content
-        return await asyncio.to_thread(_run)
+    # Double submits of the same question share the first request's answer
+    key = (current_user.id, conversation.id,
+           hashlib.blake2b(message_data.content.encode("utf-8"), digest_size=16).digest())
+    new_bot_message = await _run_once(key, current_user.id, build_bot_message)
 
-    async def call_finetuned_only() -> str:
-        def _run():
-            prompt = (
-                message_data.content
-            )
-            completion = client.chat.completions.create(
-                model=client.model,
-                messages=[{"role": "user", "content": prompt}],
-            )
-            return "**3) Fine-tuned:** " + completion.choices[0].message.content
-        return await asyncio.to_thread(_run)
+    return Response(
+        status_code=status.HTTP_201_CREATED,
+        message="Message created successfully with bot response",
+        data=new_bot_message
+    )
 
-    # 5) Run all three calls concurrently
-    try:
-        ft_rag_ans, raw_ans, ft_only_ans = await asyncio.gather(
-            call_finetuned_with_rag(),
-            call_raw_model(),
-            call_finetuned_only(),
-        )
-    except Exception as e:
+@route.post("/stream", status_code=status.HTTP_201_CREATED)
+async def create_message_with_rag_stream(
+    message_data: MessageCreate,
+    background: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Same as `create_message_with_rag`, but streams the answer as NDJSON while
+    the models generate it:
+    - {"section": "rag" | "plain" | "cached", "delta": "..."} for each chunk
+    - {"done": true, "data": <MessageOut>} once the bot message is complete
+    - {"error": "..."} if a model call fails
+    The bot message is saved before the "done" event is sent.
+    """
+    conversation = await Conversation.find_one(
+        Conversation.id == message_data.conversation_id,
+        Conversation.user.id == current_user.id
+    )
+    if not conversation:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to get response from chatbot: {e}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation not found or you don't have permission"
         )
 
-    # 6) Combine to one bot message content
-    rsp_content = "\n\n".join([ft_rag_ans, raw_ans, ft_only_ans])
-
-    new_bot_message = Message(
-        conversation=conversation.id,
-        sender_type="Bot",
-        content=rsp_content
-    )
-    await new_bot_message.insert()
-
-    await conversation.update_last_updated()
+    # Streams are not shared, but still count towards the per-user cap since
+    # each one holds inference threads for the whole generation
+    _acquire_user_slot(current_user.id)
+    try:
+        cached_content, cache_probe = await asyncio.to_thread(
+            semantic_cache.lookup, message_data.content)
 
-    return Response(
+        new_user_message = Message(
+            **message_data.model_dump(exclude={"conversation_id"}),
+            conversation=conversation.id,
+            sender_type="User"
+        )
+        user_insert = asyncio.create_task(new_user_message.insert())
+
+        if cached_content is None:
+            rag_context = await asyncio.to_thread(
+                rag_instance.generate_prompt, message_data.content,
+                cache_probe.ids, cache_probe.version)
+        await user_insert
+    except BaseException:
+        _release_user_slot(current_user.id)
+        raise
+
+    def _event(payload: dict) -> str:
+        return json.dumps(payload, ensure_ascii=False) + "\n"
+
+    async def pump(events: asyncio.Queue, answers: dict, section: str, prompt: str):
+        try:
+            key = _answer_cache_key(client.model, prompt)
+            answer = _ANS_CACHE.get(key)
+            if answer is None:
+                parts = []
+                async for delta in inference_worker.stream(prompt):
+                    parts.append(delta)
+                    await events.put((section, delta))
+                answer = "".join(parts)
+                _ANS_CACHE[key] = answer
+            else:
+                await events.put((section, answer))
+            answers[section] = answer
+        except Exception as e:
+            await events.put((section, e))
+        finally:
+            await events.put((section, None))
+
+    async def stream_events():
+        if cached_content is not None:
+            rsp_content = cached_content
+            yield _event({"section": "cached", "delta": cached_content})
+        else:
+            events = asyncio.Queue()
+            answers = {}
+            pumps = [
+                asyncio.create_task(pump(events, answers, "rag", rag_context)),
+                asyncio.create_task(pump(events, answers, "plain", message_data.content)),
+            ]
+            try:
+                running = len(pumps)
+                while running:
+                    section, delta = await events.get()
+                    if delta is None:
+                        running -= 1
+                    elif isinstance(delta, Exception):
+                        yield _event({"error": f"Failed to get response from chatbot: {delta}"})
+                        return
+                    else:
+                        yield _event({"section": section, "delta": delta})
+            finally:
+                for task in pumps:
+                    task.cancel()
+
+            rsp_content = _combine_answers(answers["rag"], answers["plain"])
+            semantic_cache.store(cache_probe, rsp_content)
+
+        new_bot_message = Message(
+            conversation=conversation.id,
+            sender_type="Bot",
+            content=rsp_content
+        )
+        try:
+            await new_bot_message.insert()
+        except Exception as e:
+            yield _event({"error": f"Failed to save bot message: {e}"})
+            return
+        background.add_task(conversation.update_last_updated)
+
+        out = MessageOut.model_validate(new_bot_message)
+        yield _event({"done": True, "data": out.model_dump(mode="json")})
+
+    async def generate():
+        try:
+            async for event in stream_events():
+                yield event
+        finally:
+            release_slot()
+
+    body = generate()
+    # Runs once: when the stream ends, or when it is dropped without ever
+    # starting (the client left before the first chunk)
+    release_slot = weakref.finalize(body, _release_user_slot, current_user.id)
+
+    return StreamingResponse(
+        body,
         status_code=status.HTTP_201_CREATED,
-        message="Message created successfully with bot response",
-        data=new_bot_message
+        media_type="application/x-ndjson",
+        background=background,
     )
 
 # @route.post("/raw/", status_code=status.HTTP_201_CREATED, response_model=Response[MessageOut])
@@ -298,12 +648,12 @@ async def delete_message(message_id: PydanticObjectId, current_user: User = Depe
     """
     Delete a specific message.
     """
-    message = await Message.get(message_id, fetch_links=True)
+    message = await Message.get(message_id)
     if not message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
 
-    if message.conversation.user.id != current_user.id:
+    if not await _owns_conversation(message.conversation.ref.id, current_user.id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="You don't have permission to delete this message")
 
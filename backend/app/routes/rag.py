@@ -4,6 +4,7 @@ from app.helpers.helpers import process_document_to_faiss
 
 from app.rag.rag_module import index, metadata, rag
 
+import asyncio
 import os
 
 route = APIRouter(
@@ -36,14 +37,19 @@ async def upload_file(file: UploadFile = File(...), start_page: int = 1, end_pag
         )
     else:
         try:
-            process_document_to_faiss(
+            # Extraction and embedding are slow and searches run on worker
+            # threads, so index off the event loop under the index lock
+            await asyncio.to_thread(
+                process_document_to_faiss,
                 file_upload=file,
                 start_page=start_page,
                 end_page=end_page,
                 topic=topic,
                 source=file.filename,
                 index=index,
-                vector_data=metadata
+                vector_data=metadata,
+                lock=rag.index_lock,
+                on_update=rag.bump_index_version
             )
         except Exception as e:
             return JSONResponse(
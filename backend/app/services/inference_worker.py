@@ -0,0 +1,68 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_END = object()
+
+
+class InferenceWorker:
+    """
+    Runs blocking inference calls on a dedicated thread pool so they neither
+    starve the default executor nor exceed `max_workers` calls in flight.
+    Each prompt is dispatched immediately: the chat completion endpoint only
+    accepts one conversation per request, and identical concurrent prompts
+    are already collapsed by the answer cache.
+    """
+
+    def __init__(self, complete, max_workers: int, stream_complete=None):
+        self.complete = complete
+        self.stream_complete = stream_complete
+        # Long-lived threads keep their keep-alive HTTP sessions warm
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="hf-inference")
+
+    async def submit(self, prompt: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.complete, prompt)
+
+    async def stream(self, prompt: str):
+        """
+        Yield the chunks of `stream_complete(prompt)` as the server produces
+        them.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        stopped = threading.Event()
+
+        def _put(item):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                pass  # event loop already closed
+
+        def _produce():
+            try:
+                for chunk in self.stream_complete(prompt):
+                    if stopped.is_set():
+                        break
+                    _put(chunk)
+            except Exception as e:
+                _put(e)
+            finally:
+                _put(_END)
+
+        loop.run_in_executor(self._executor, _produce)
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is _END:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            # Lets the producer thread drop the connection if we stop early
+            stopped.set()
+
+    async def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)